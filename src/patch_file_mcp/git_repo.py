@@ -3,39 +3,58 @@ Git repository management for patch file versioning.
 Based on Aider's GitRepo implementation but simplified for MCP server use.
 """
 
+import os
 from pathlib import Path
 from typing import Optional, List, Tuple
 
-try:
-    import git  # type: ignore[import-not-found]
-
+# Errors that can surface from any git operation, with or without GitPython
+_BASE_GIT_ERRORS = (
+    OSError,
+    IndexError,
+    BufferError,
+    TypeError,
+    ValueError,
+    AttributeError,
+    AssertionError,
+    TimeoutError,
+)
+ANY_GIT_ERROR = _BASE_GIT_ERRORS
+
+# GitPython is imported on first use rather than at module import; it pulls
+# in gitdb/smmap and dominates the import time of this module otherwise.
+_NOT_LOADED = object()
+git = _NOT_LOADED
+
+
+def _load_git():
+    """
+    Import GitPython on first use.
+
+    Also extends ANY_GIT_ERROR with GitPython's exception types once the
+    module is available.
+
+    Returns:
+        The git module, or None if GitPython is not installed
+    """
+    global git, ANY_GIT_ERROR
+
+    if git is not _NOT_LOADED:
+        return git
+
+    try:
+        import git as git_module  # type: ignore[import-not-found]
+    except ImportError:
+        git = None
+        return None
+
+    git = git_module
     ANY_GIT_ERROR = (
-        git.exc.ODBError,
-        git.exc.GitError,
-        git.exc.InvalidGitRepositoryError,
-        git.exc.GitCommandNotFound,
-        OSError,
-        IndexError,
-        BufferError,
-        TypeError,
-        ValueError,
-        AttributeError,
-        AssertionError,
-        TimeoutError,
-    )
-except ImportError:
-    git = None  # type: ignore[assignment]
-    ANY_GIT_ERROR = (  # type: ignore[assignment]
-        OSError,
-        IndexError,
-        BufferError,
-        TypeError,
-        ValueError,
-        AttributeError,
-        AssertionError,
-        TimeoutError,
-    )
-    print("Warning: GitPython not available. Git versioning will be disabled.")
+        git_module.exc.ODBError,
+        git_module.exc.GitError,
+        git_module.exc.InvalidGitRepositoryError,
+        git_module.exc.GitCommandNotFound,
+    ) + _BASE_GIT_ERRORS
+    return git
 
 
 class GitRepo:
@@ -52,7 +71,11 @@ class GitRepo:
         self.logger = logger
         self.root = None
         self.repo = None
-        self.git_available = git is not None
+        # Normalized root string and "root/" prefix for cheap containment checks
+        self._root_str: Optional[str] = None
+        self._root_prefix: Optional[str] = None
+        git_module = _load_git()
+        self.git_available = git_module is not None
 
         if not self.git_available:
             if self.logger:
@@ -69,17 +92,23 @@ class GitRepo:
 
             # Try to find git repo, searching parent directories if needed
             try:
-                repo = git.Repo(repo_path, search_parent_directories=True)
+                repo = git_module.Repo(repo_path, search_parent_directories=True)
                 self.repo = repo
                 working_dir = repo.working_tree_dir
                 if working_dir is None:
                     raise ValueError("Repository has no working tree directory")
                 self.root = Path(working_dir).resolve()
+                self._root_str = os.path.normcase(str(self.root))
+                self._root_prefix = (
+                    self._root_str
+                    if self._root_str.endswith(os.sep)
+                    else self._root_str + os.sep
+                )
                 if self.logger:
                     self.logger.info(f"Found git repository at: {self.root}")
             except ANY_GIT_ERROR as e:
                 if self.logger:
-                    self.logger.debug(f"No git repository found at {repo_path}: {e}")
+                    self.logger.debug("No git repository found at %s: %s", repo_path, e)
                 return
 
         except Exception as e:
@@ -91,6 +120,32 @@ class GitRepo:
         """Check if git is available and repository is valid."""
         return self.git_available and self.repo is not None
 
+    def _to_repo_relative(self, file_path: str) -> Optional[str]:
+        """
+        Convert a file path into a path relative to the repository root.
+
+        Most paths are handled with a string prefix check against the cached
+        root, without touching the filesystem. Paths that only reach the
+        repository through a symlink fall back to Path.resolve().
+
+        Args:
+            file_path: Absolute or working-directory-relative file path
+
+        Returns:
+            Optional[str]: Repository-relative path, or None if outside the repo
+        """
+        if self.root is None or self._root_prefix is None:
+            return None
+
+        abs_path = os.path.abspath(file_path)
+        if os.path.normcase(abs_path).startswith(self._root_prefix):
+            return abs_path[len(self._root_prefix) :]
+
+        try:
+            return str(Path(file_path).resolve().relative_to(self.root))
+        except (OSError, RuntimeError, ValueError):
+            return None
+
     def get_head_commit_sha(self, short: bool = True) -> Optional[str]:
         """Get the current HEAD commit SHA."""
         if not self.is_available():
@@ -126,17 +181,27 @@ class GitRepo:
         try:
             if self.repo is None:
                 return []
-            dirty_files = set()
-
-            # Get staged files
-            staged_files = self.repo.git.diff("--name-only", "--cached").splitlines()
-            dirty_files.update(staged_files)
-
-            # Get unstaged files
-            unstaged_files = self.repo.git.diff("--name-only").splitlines()
-            dirty_files.update(unstaged_files)
+            # One status call covers both staged and unstaged changes.
+            # Entries are NUL-separated "XY path"; renames and copies are
+            # followed by an extra entry holding the original path.
+            status_output = self.repo.git.status(
+                "--porcelain", "-z", "--untracked-files=no"
+            )
+            entries = status_output.split("\0")
+
+            dirty_files = []
+            i = 0
+            while i < len(entries):
+                entry = entries[i]
+                i += 1
+                if len(entry) < 4:
+                    continue
+                dirty_files.append(entry[3:])
+                if "R" in entry[:2] or "C" in entry[:2]:
+                    # Skip the original path of a rename/copy
+                    i += 1
 
-            return list(dirty_files)
+            return dirty_files
         except ANY_GIT_ERROR:
             return []
 
@@ -157,31 +222,40 @@ class GitRepo:
             # Convert to relative paths from repo root
             repo_relative_paths = []
             for file_path in file_paths:
-                abs_path = Path(file_path).resolve()
-                try:
-                    if self.root is None:
-                        continue
-                    rel_path = abs_path.relative_to(self.root)
-                    repo_relative_paths.append(str(rel_path))
-                except ValueError:
+                rel_path = self._to_repo_relative(file_path)
+                if rel_path is None:
                     # File is not within repo, skip it
                     if self.logger:
                         self.logger.warning(
                             f"File {file_path} is not within git repository {self.root}"
                         )
                     continue
+                repo_relative_paths.append(rel_path)
 
             if not repo_relative_paths:
                 return False
 
-            # Stage the files
+            # Stage all files with a single git invocation
             if self.repo is None:
                 return False
+            try:
+                self.repo.git.add("--", *repo_relative_paths)
+                if self.logger:
+                    for file_to_stage in repo_relative_paths:
+                        self.logger.debug("Staged file: %s", file_to_stage)
+                return True
+            except ANY_GIT_ERROR as e:
+                if self.logger:
+                    self.logger.debug(
+                        "Batched staging failed, retrying per file: %s", e
+                    )
+
+            # One bad path fails the whole batch; stage the rest individually
             for file_to_stage in repo_relative_paths:
                 try:
-                    self.repo.git.add(file_to_stage)
+                    self.repo.git.add("--", file_to_stage)
                     if self.logger:
-                        self.logger.debug(f"Staged file: {file_to_stage}")
+                        self.logger.debug("Staged file: %s", file_to_stage)
                 except ANY_GIT_ERROR as e:
                     if self.logger:
                         self.logger.warning(f"Failed to stage {file_to_stage}: {e}")
@@ -217,33 +291,31 @@ class GitRepo:
                     self.logger.warning("Failed to stage files for commit")
                 return None
 
-            # Check if there are actually changes to commit
-            if not self.is_dirty():
-                if self.logger:
-                    self.logger.debug("No changes to commit")
-                return None
-
             # Create commit
             commit_cmd = ["-m", message]
 
             # Only commit the specific files
             repo_relative_paths = []
             for file_path in file_paths:
-                abs_path = Path(file_path).resolve()
-                try:
-                    if self.root is None:
-                        continue
-                    rel_path = abs_path.relative_to(self.root)
-                    repo_relative_paths.append(str(rel_path))
-                except ValueError:
-                    continue
+                rel_path = self._to_repo_relative(file_path)
+                if rel_path is not None:
+                    repo_relative_paths.append(rel_path)
 
             if repo_relative_paths:
                 commit_cmd.extend(["--"] + repo_relative_paths)
 
             if self.repo is None:
                 return None
-            self.repo.git.commit(commit_cmd)
+            try:
+                self.repo.git.commit(commit_cmd)
+            except ANY_GIT_ERROR:
+                # Only look at the index once the commit has failed; its exit
+                # status does not depend on the language git prints in
+                if not self._has_staged_changes(repo_relative_paths):
+                    if self.logger:
+                        self.logger.debug("No changes to commit")
+                    return None
+                raise
 
             # Get the new commit hash
             commit_hash = self.get_head_commit_sha(short=True)
@@ -263,6 +335,30 @@ class GitRepo:
                 self.logger.error(f"Failed to commit files: {e}")
             return None
 
+    def _has_staged_changes(self, repo_relative_paths: List[str]) -> bool:
+        """
+        Check whether the index differs from HEAD for the given paths.
+
+        Args:
+            repo_relative_paths: Repository-relative paths to check
+
+        Returns:
+            bool: False only if git reports no staged changes for the paths
+        """
+        if self.repo is None:
+            return False
+        status, _, _ = self.repo.git.diff(
+            "--cached",
+            "--quiet",
+            "--",
+            *repo_relative_paths,
+            with_extended_output=True,
+            with_exceptions=False,
+        )
+        # Exit status 1 means there are differences; anything else non-zero is
+        # an error, and the original commit failure should surface
+        return status != 0
+
     def is_file_tracked(self, file_path: str) -> bool:
         """
         Check if a file is tracked by git.
@@ -281,20 +377,15 @@ class GitRepo:
                 return False
 
             # Convert to relative path from repo root
-            abs_path = Path(file_path).resolve()
-            if self.root is None:
-                return False
-
-            try:
-                rel_path = abs_path.relative_to(self.root)
-            except ValueError:
+            rel_path = self._to_repo_relative(file_path)
+            if rel_path is None:
                 # File is not within repo
                 return False
 
             # Check if file is in the git index (tracked)
             try:
                 # This will raise an exception if the file is not tracked
-                self.repo.git.ls_files("--error-unmatch", str(rel_path))
+                self.repo.git.ls_files("--error-unmatch", rel_path)
                 return True
             except ANY_GIT_ERROR:
                 return False
@@ -317,13 +408,8 @@ class GitRepo:
 
         try:
             # Convert to relative path from repo root
-            abs_path = Path(file_path).resolve()
-            if self.root is None:
-                return False
-
-            try:
-                rel_path = abs_path.relative_to(self.root)
-            except ValueError:
+            rel_path = self._to_repo_relative(file_path)
+            if rel_path is None:
                 # File is not within repo
                 if self.logger:
                     self.logger.warning(
@@ -335,7 +421,7 @@ class GitRepo:
             if self.repo is None:
                 return False
 
-            self.repo.git.add(str(rel_path))
+            self.repo.git.add(rel_path)
             if self.logger:
                 self.logger.info(f"Added file to git tracking: {rel_path}")
             return True
@@ -345,6 +431,48 @@ class GitRepo:
                 self.logger.error(f"Failed to add file to git tracking: {e}")
             return False
 
+    def read_blob(self, file_path: str, ref: str = "HEAD") -> Optional[bytes]:
+        """
+        Read the content of a file as stored in a given revision.
+
+        Object reads go through GitPython's persistent "git cat-file --batch"
+        process, so repeated reads do not spawn a new git process each time.
+
+        Args:
+            file_path: Path to the file to read
+            ref: Revision to read the file from (default: HEAD)
+
+        Returns:
+            Optional[bytes]: File content, or None if it cannot be read
+        """
+        if not self.is_available():
+            return None
+
+        rel_path = self._to_repo_relative(file_path)
+        if rel_path is None or self.repo is None:
+            return None
+
+        try:
+            _, _, _, data = self.repo.git.get_object_data(
+                f"{ref}:{rel_path.replace(os.sep, '/')}"
+            )
+            return data
+        except ANY_GIT_ERROR as e:
+            if self.logger:
+                self.logger.debug("Failed to read %s at %s: %s", rel_path, ref, e)
+            return None
+
+    def close(self) -> None:
+        """Stop the persistent git processes held by the repository."""
+        if self.repo is None:
+            return
+
+        try:
+            self.repo.close()
+        except ANY_GIT_ERROR as e:
+            if self.logger:
+                self.logger.debug("Failed to close git repository: %s", e)
+
     def get_commit_message(self, file_paths: List[str]) -> str:
         """
         Generate a commit message for the given files.
@@ -359,7 +487,7 @@ class GitRepo:
             return "Update files"
 
         if len(file_paths) == 1:
-            file_name = Path(file_paths[0]).name
+            file_name = os.path.basename(file_paths[0])
             return f"Update {file_name}"
         else:
             return f"Update {len(file_paths)} files"
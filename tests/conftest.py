@@ -90,6 +90,29 @@ def hello():
 >>>>>>> REPLACE"""
 
 
+@pytest.fixture
+def temp_git_repo(tmp_path):
+    """Create an isolated git repository with one committed file."""
+    git = pytest.importorskip("git")
+    repo = git.Repo.init(tmp_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "Test User")
+        config.set_value("user", "email", "test@example.com")
+    (tmp_path / "tracked.txt").write_text("original\n")
+    repo.git.add("tracked.txt")
+    repo.git.commit("-m", "Initial commit")
+    return tmp_path
+
+
+def _route_background_commands(mock_run):
+    """Send background QA commands (mypy) through the same mock as foreground ones."""
+
+    def execute(self, cmd, cwd=None, timeout=30, env=None):
+        return mock_run(cmd, cwd=cwd, timeout=timeout, shell=False, env=env)
+
+    return patch("patch_file_mcp.server._BackgroundCommand._execute", execute)
+
+
 @pytest.fixture
 def mock_subprocess_run():
     """Mock subprocess.run for testing."""
@@ -100,7 +123,8 @@ def mock_subprocess_run():
             return (True, "", "", 0)
 
         mock_run.side_effect = mock_command
-        yield mock_run
+        with _route_background_commands(mock_run):
+            yield mock_run
 
 
 @pytest.fixture
@@ -108,7 +132,7 @@ def mock_qa_pipeline_complex():
     """Mock subprocess.run with complex QA pipeline behavior."""
     with (
         patch("patch_file_mcp.server.run_command_with_timeout") as mock_run,
-        patch("patch_file_mcp.server.get_file_modification_time") as mock_time,
+        patch("patch_file_mcp.server.get_file_content_digest") as mock_digest,
     ):
 
         call_count = {"ruff": 0, "black": 0, "mypy": 0}
@@ -133,16 +157,17 @@ def mock_qa_pipeline_complex():
 
             return (True, "", "", 0)
 
-        # Mock file modification time to simulate file changes
-        def mock_get_time(file_path):
+        # Mock file content digest to simulate file changes
+        def mock_get_digest(file_path):
             if file_modified:
-                return 100.0  # Initial time
+                return b"original"  # Initial content
             else:
-                return 200.0  # Modified time (different)
+                return b"reformatted"  # Modified content (different)
 
-        mock_time.side_effect = mock_get_time
+        mock_digest.side_effect = mock_get_digest
         mock_run.side_effect = mock_command
-        yield mock_run
+        with _route_background_commands(mock_run):
+            yield mock_run
 
 
 @pytest.fixture
@@ -159,7 +184,8 @@ def mock_qa_pipeline_timeout():
             return (True, "", "", 0)
 
         mock_run.side_effect = mock_command
-        yield mock_run
+        with _route_background_commands(mock_run):
+            yield mock_run
 
 
 @pytest.fixture
@@ -167,7 +193,7 @@ def mock_qa_pipeline_warnings():
     """Mock subprocess.run that simulates warnings."""
     with (
         patch("patch_file_mcp.server.run_command_with_timeout") as mock_run,
-        patch("patch_file_mcp.server.get_file_modification_time") as mock_time,
+        patch("patch_file_mcp.server.get_file_content_digest") as mock_digest,
     ):
 
         def mock_command(cmd, cwd=None, timeout=30, shell=False, env=None):
@@ -182,10 +208,11 @@ def mock_qa_pipeline_warnings():
                 return (True, "", "", 0)  # mypy succeeds
             return (True, "", "", 0)
 
-        # Mock file modification time to simulate no changes
-        mock_time.return_value = 100.0
+        # Mock file content digest to simulate no changes
+        mock_digest.return_value = b"original"
         mock_run.side_effect = mock_command
-        yield mock_run
+        with _route_background_commands(mock_run):
+            yield mock_run
 
 
 @pytest.fixture
@@ -193,7 +220,7 @@ def mock_qa_pipeline_iteration_limit():
     """Mock subprocess.run that simulates infinite reformatting loop."""
     with (
         patch("patch_file_mcp.server.run_command_with_timeout") as mock_run,
-        patch("patch_file_mcp.server.get_file_modification_time") as mock_time,
+        patch("patch_file_mcp.server.get_file_content_digest") as mock_digest,
     ):
 
         # Always return different times to simulate continuous file modifications
@@ -209,16 +236,17 @@ def mock_qa_pipeline_iteration_limit():
                 return (True, "", "", 0)  # mypy succeeds
             return (True, "", "", 0)
 
-        # Mock file modification time to always return increasing values
+        # Mock file content digest to always return new values
         # This simulates the file being continuously modified
-        def mock_get_time(file_path):
+        def mock_get_digest(file_path):
             nonlocal time_call_count
             time_call_count += 1
-            return float(time_call_count * 100)  # Always increasing time
+            return str(time_call_count).encode()  # Always different content
 
-        mock_time.side_effect = mock_get_time
+        mock_digest.side_effect = mock_get_digest
         mock_run.side_effect = mock_command
-        yield mock_run
+        with _route_background_commands(mock_run):
+            yield mock_run
 
 
 @pytest.fixture
@@ -5,7 +5,7 @@ Tests for git versioning and recovery functionality.
 import os
 import tempfile
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import pytest
 
@@ -124,6 +124,13 @@ class TestGitRepo:
         assert isinstance(message, str)
         assert len(message) > 0
 
+    def test_get_commit_message_uses_file_name(self):
+        """Test that the single-file message names only the file, not its path."""
+        repo = GitRepo(".", logger=None)
+        file_path = os.path.join("src", "pkg", "module.py")
+
+        assert repo.get_commit_message([file_path]) == "Update module.py"
+
     def test_get_commit_message_multiple_files(self):
         """Test generating commit message for multiple files."""
         repo = GitRepo(".", logger=None)
@@ -660,3 +667,229 @@ class TestGitVersioningIntegrationWithTracking:
             # Restore originals
             server_module.DISABLE_VERSIONING = original_disabled
             server_module.git_repo = original_git_repo
+
+
+class TestGitStagingBatch:
+    """Test staging several files in an isolated repository."""
+
+    def test_stage_files_stages_all_files_in_one_call(self, temp_git_repo):
+        """Test that all files are passed to a single git add invocation."""
+        (temp_git_repo / "a.txt").write_text("a\n")
+        (temp_git_repo / "b.txt").write_text("b\n")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+        real_git = repo.repo.git
+        mock_repo = MagicMock()
+        mock_repo.git.add.side_effect = real_git.add
+
+        with patch.object(repo, "repo", mock_repo):
+            result = repo.stage_files(
+                [str(temp_git_repo / "a.txt"), str(temp_git_repo / "b.txt")]
+            )
+
+        assert result is True
+        assert mock_repo.git.add.call_count == 1
+        staged = real_git.diff("--name-only", "--cached").splitlines()
+        assert sorted(staged) == ["a.txt", "b.txt"]
+
+    def test_stage_files_falls_back_per_file_on_bad_path(self, temp_git_repo):
+        """Test that one unmatched path does not prevent staging the others."""
+        (temp_git_repo / "a.txt").write_text("a\n")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        result = repo.stage_files(
+            [str(temp_git_repo / "a.txt"), str(temp_git_repo / "missing.txt")]
+        )
+
+        assert result is True
+        staged = repo.repo.git.diff("--name-only", "--cached").splitlines()
+        assert staged == ["a.txt"]
+
+
+class TestGitDirtyFiles:
+    """Test dirty file detection in an isolated repository."""
+
+    def test_get_dirty_files_clean_repo(self, temp_git_repo):
+        """Test that a clean repository reports no dirty files."""
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        assert repo.get_dirty_files() == []
+
+    def test_get_dirty_files_staged_unstaged_and_renamed(self, temp_git_repo):
+        """Test staged, unstaged and renamed files are each reported once."""
+        (temp_git_repo / "other.txt").write_text("other\n")
+        (temp_git_repo / "sub").mkdir()
+        (temp_git_repo / "sub" / "nested.txt").write_text("nested\n")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+        repo.repo.git.add("other.txt", "sub/nested.txt")
+        repo.repo.git.commit("-m", "Add files")
+
+        # Staged and then modified again in the working tree
+        (temp_git_repo / "tracked.txt").write_text("staged\n")
+        repo.repo.git.add("tracked.txt")
+        (temp_git_repo / "tracked.txt").write_text("staged and unstaged\n")
+        # Unstaged only
+        (temp_git_repo / "sub" / "nested.txt").write_text("changed\n")
+        # Renamed
+        repo.repo.git.mv("other.txt", "renamed.txt")
+        # Untracked files are not reported
+        (temp_git_repo / "untracked.txt").write_text("untracked\n")
+
+        dirty_files = repo.get_dirty_files()
+
+        assert sorted(dirty_files) == ["renamed.txt", "sub/nested.txt", "tracked.txt"]
+
+
+class TestGitCommitFiles:
+    """Test committing in an isolated repository."""
+
+    def test_commit_files_commits_modified_file(self, temp_git_repo):
+        """Test that a modified file is committed."""
+        tracked = temp_git_repo / "tracked.txt"
+        tracked.write_text("changed\n")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        result = repo.commit_files([str(tracked)], "Update tracked.txt")
+
+        assert result is not None
+        commit_hash, message = result
+        assert message == "Update tracked.txt"
+        assert repo.get_head_commit_sha() == commit_hash
+        assert repo.get_dirty_files() == []
+
+    def test_commit_files_nothing_to_commit(self, temp_git_repo):
+        """Test that an unchanged file returns None without logging an error."""
+        logger = MagicMock()
+        repo = GitRepo(str(temp_git_repo), logger=logger)
+        head_before = repo.get_head_commit_sha()
+
+        result = repo.commit_files(
+            [str(temp_git_repo / "tracked.txt")], "Update tracked.txt"
+        )
+
+        assert result is None
+        assert repo.get_head_commit_sha() == head_before
+        logger.error.assert_not_called()
+
+    def test_commit_files_nothing_to_commit_with_localized_git(self, temp_git_repo):
+        """Test that "no changes" is detected without matching git's messages."""
+        git = pytest.importorskip("git")
+        logger = MagicMock()
+        repo = GitRepo(str(temp_git_repo), logger=logger)
+        localized_error = git.exc.GitCommandError(
+            ["git", "commit"],
+            1,
+            stdout="nichts zu committen, Arbeitsverzeichnis unverändert",
+        )
+
+        with patch.object(
+            type(repo.repo.git), "commit", side_effect=localized_error, create=True
+        ):
+            result = repo.commit_files(
+                [str(temp_git_repo / "tracked.txt")], "Update tracked.txt"
+            )
+
+        assert result is None
+        logger.error.assert_not_called()
+
+    def test_commit_files_failure_with_staged_changes_is_logged(self, temp_git_repo):
+        """Test that a failed commit of real changes is still reported as an error."""
+        git = pytest.importorskip("git")
+        tracked = temp_git_repo / "tracked.txt"
+        tracked.write_text("changed\n")
+        logger = MagicMock()
+        repo = GitRepo(str(temp_git_repo), logger=logger)
+        hook_error = git.exc.GitCommandError(["git", "commit"], 1, stderr="hook failed")
+
+        with patch.object(
+            type(repo.repo.git), "commit", side_effect=hook_error, create=True
+        ):
+            result = repo.commit_files([str(tracked)], "Update tracked.txt")
+
+        assert result is None
+        logger.error.assert_called_once()
+
+
+class TestGitRepoRelativePaths:
+    """Test conversion of file paths to repository-relative paths."""
+
+    def test_nested_file_is_relative_to_root(self, temp_git_repo):
+        """Test that files below the root map to repository-relative paths."""
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        rel_path = repo._to_repo_relative(str(temp_git_repo / "sub" / "file.py"))
+
+        assert rel_path == os.path.join("sub", "file.py")
+
+    def test_sibling_with_common_prefix_is_outside(self, temp_git_repo):
+        """Test that a sibling directory sharing the root's name prefix is rejected."""
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        assert repo._to_repo_relative(f"{temp_git_repo}X/file.py") is None
+
+    def test_path_through_symlink_is_resolved(self, temp_git_repo, tmp_path_factory):
+        """Test that a path reaching the repository through a symlink is accepted."""
+        link = tmp_path_factory.mktemp("links") / "repo_link"
+        try:
+            link.symlink_to(temp_git_repo, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            pytest.skip("Symlinks are not supported on this platform")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        assert repo._to_repo_relative(str(link / "tracked.txt")) == "tracked.txt"
+
+
+class TestGitReadBlob:
+    """Test reading committed file content."""
+
+    def test_read_blob_returns_committed_content(self, temp_git_repo):
+        """Test that committed content is returned, not the working tree."""
+        tracked = temp_git_repo / "tracked.txt"
+        tracked.write_text("working tree\n")
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        try:
+            assert repo.read_blob(str(tracked)) == b"original\n"
+
+            repo.commit_files([str(tracked)], "Update tracked.txt")
+            assert repo.read_blob(str(tracked)) == b"working tree\n"
+            assert repo.read_blob(str(tracked), ref="HEAD~1") == b"original\n"
+        finally:
+            repo.close()
+
+    def test_read_blob_missing_file(self, temp_git_repo):
+        """Test that files absent from the revision return None."""
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        try:
+            assert repo.read_blob(str(temp_git_repo / "missing.txt")) is None
+        finally:
+            repo.close()
+
+    def test_read_blob_outside_repo(self, temp_git_repo, tmp_path_factory):
+        """Test that files outside the repository return None."""
+        outside = tmp_path_factory.mktemp("outside") / "file.txt"
+        repo = GitRepo(str(temp_git_repo), logger=None)
+
+        assert repo.read_blob(str(outside)) is None
+
+
+class TestGitLazyImport:
+    """Test that GitPython is only imported when a repository is opened."""
+
+    def test_module_import_does_not_import_gitpython(self):
+        """Test importing git_repo leaves GitPython unloaded until first use."""
+        import subprocess
+        import sys
+
+        code = (
+            "import sys\n"
+            "import patch_file_mcp.git_repo as git_repo\n"
+            "print('git' in sys.modules)\n"
+            "git_repo.GitRepo('.')\n"
+            "print('git' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+
+        assert result.stdout.split() == ["False", "True"]
@@ -8,6 +8,7 @@ import os
 
 # Import the functions we want to test
 from patch_file_mcp.server import (
+    get_file_content_digest,
     get_file_modification_time,
     run_command_with_timeout,
     parse_search_replace_blocks,
@@ -27,7 +28,7 @@ class TestIntegration:
         mod_time = get_file_modification_time(str(test_file))
 
         # Verify it's a valid timestamp
-        assert isinstance(mod_time, float)
+        assert isinstance(mod_time, int)
         assert mod_time > 0
 
         # Modify file and check time changes
@@ -37,6 +38,38 @@ class TestIntegration:
 
         assert new_mod_time > mod_time
 
+    def test_get_file_content_digest(self, tmp_path):
+        """Test that the content digest changes with the content, not the timestamp."""
+        test_file = tmp_path / "test.txt"
+        test_file.write_text("test content")
+        digest = get_file_content_digest(str(test_file))
+
+        # Rewriting the same content keeps the digest
+        test_file.write_text("test content")
+        assert get_file_content_digest(str(test_file)) == digest
+
+        # Changing the content without any delay changes it
+        test_file.write_text("test content!")
+        assert get_file_content_digest(str(test_file)) != digest
+
+    @pytest.mark.parametrize("has_file_digest", [True, False])
+    def test_get_file_content_digest_is_blake2b(
+        self, tmp_path, monkeypatch, has_file_digest
+    ):
+        """Test that the chunked digest matches hashing the whole content."""
+        import hashlib
+
+        content = os.urandom(200_000)
+        test_file = tmp_path / "data.bin"
+        test_file.write_bytes(content)
+        if not has_file_digest:
+            monkeypatch.delattr(hashlib, "file_digest", raising=False)
+
+        assert (
+            get_file_content_digest(str(test_file))
+            == hashlib.blake2b(content, digest_size=16).digest()
+        )
+
     def test_run_command_with_timeout_success(self):
         """Test successful command execution."""
         if os.name == "nt":  # Windows
@@ -59,14 +92,32 @@ class TestIntegration:
         with patch("patch_file_mcp.server.subprocess.run") as mock_run:
             mock_result = MagicMock()
             mock_result.returncode = 1
-            mock_result.stdout = ""
-            mock_result.stderr = "Command failed"
+            mock_result.stdout = b""
+            mock_result.stderr = b"Command failed"
             mock_run.return_value = mock_result
 
             success, stdout, stderr, returncode = run_command_with_timeout("false")
 
         assert success is False
         assert returncode == 1
+        assert stderr == "Command failed"
+
+    def test_run_command_with_timeout_decodes_output(self):
+        """Test that output is decoded as UTF-8 with universal newlines."""
+        from unittest.mock import patch, MagicMock
+
+        with patch("patch_file_mcp.server.subprocess.run") as mock_run:
+            mock_result = MagicMock()
+            mock_result.returncode = 1
+            mock_result.stdout = "caf\u00e9: error\r\nnext\r\n".encode() + b"\xff"
+            mock_result.stderr = b""
+            mock_run.return_value = mock_result
+
+            success, stdout, stderr, returncode = run_command_with_timeout(["mypy"])
+
+        assert stdout == "caf\u00e9: error\nnext\n\ufffd"
+        assert stderr == ""
+        assert "text" not in mock_run.call_args.kwargs
 
     def test_run_command_with_timeout_timeout(self):
         """Test command timeout."""
@@ -178,6 +229,17 @@ content
         with pytest.raises(ValueError, match="Incorrect marker sequence"):
             validate_block_integrity(invalid_patch)
 
+    def test_validate_block_integrity_crlf_and_indented_markers(self):
+        """Test that marker lines are recognised with CRLF endings and surrounding spaces."""
+        valid_patch = (
+            "<<<<<<< SEARCH\r\nold\r\n  =======  \r\nnew\r\n>>>>>>> REPLACE\r\n"
+        )
+        validate_block_integrity(valid_patch)
+
+        invalid_patch = "=======\r\nold\r\n<<<<<<< SEARCH\r\nnew\r\n>>>>>>> REPLACE"
+        with pytest.raises(ValueError, match=r"got \['=======', '<<<<<<< SEARCH'"):
+            validate_block_integrity(invalid_patch)
+
     @pytest.mark.slow
     def test_full_workflow_simulation(self, tmp_path):
         """Test a simulated full workflow (slow test)."""
@@ -227,11 +289,8 @@ def calculate_sum(a, b):
         assert "'''Calculate the sum of two numbers.'''" in final_content
         assert "Result: 8" not in final_content  # Original calculation still works
 
-    def test_parse_search_replace_blocks_fallback_parsing(self):
-        """Test fallback parsing when regex fails."""
-        from unittest.mock import patch
-
-        # Create a patch that might confuse regex but should work with fallback
+    def test_parse_search_replace_blocks_special_characters(self):
+        """Test parsing blocks whose bodies contain regex metacharacters."""
         patch_content = """<<<<<<< SEARCH
 # Special regex characters: .*+?^$()[]{}|
 # These might confuse regex patterns
@@ -239,71 +298,166 @@ def calculate_sum(a, b):
 # Modified content with special characters
 >>>>>>> REPLACE"""
 
-        # Mock re.findall to return empty (simulating regex failure)
-        with patch("patch_file_mcp.server.re.findall", return_value=[]):
-            blocks = parse_search_replace_blocks(patch_content)
+        blocks = parse_search_replace_blocks(patch_content)
 
-            assert len(blocks) == 1
-            assert "Special regex characters" in blocks[0][0]
-            assert "Modified content" in blocks[0][1]
+        assert len(blocks) == 1
+        assert "Special regex characters" in blocks[0][0]
+        assert "Modified content" in blocks[0][1]
 
-    def test_parse_search_replace_blocks_fallback_missing_separator(self):
-        """Test fallback parsing with missing separator marker."""
-        from unittest.mock import patch
+    def test_parse_search_replace_blocks_crlf_line_endings(self):
+        """Test parsing a patch that uses CRLF line endings."""
+        patch_content = (
+            "<<<<<<< SEARCH\r\nold line 1\r\nold line 2\r\n=======\r\n"
+            "new line\r\n>>>>>>> REPLACE\r\n"
+        )
 
-        # Create malformed patch missing separator
+        blocks = parse_search_replace_blocks(patch_content)
+
+        assert blocks == [("old line 1\nold line 2", "new line")]
+
+    def test_parse_search_replace_blocks_empty_search_and_replace(self):
+        """Test parsing blocks with empty search or replace bodies."""
         patch_content = """<<<<<<< SEARCH
-content without separator
+=======
+added
+>>>>>>> REPLACE
+<<<<<<< SEARCH
+removed
+=======
 >>>>>>> REPLACE"""
 
-        # Mock re.findall to return empty to trigger fallback
-        with patch("patch_file_mcp.server.re.findall", return_value=[]):
-            with pytest.raises(ValueError, match="Unbalanced markers"):
-                parse_search_replace_blocks(patch_content)
+        blocks = parse_search_replace_blocks(patch_content)
 
-    def test_parse_search_replace_blocks_fallback_missing_replace_marker(self):
-        """Test fallback parsing with missing replace marker."""
-        from unittest.mock import patch
+        assert blocks == [("", "added"), ("removed", "")]
+
+    def test_parse_search_replace_blocks_preserves_form_feed(self):
+        """Test that form feeds inside a block body are not treated as line breaks."""
+        patch_content = (
+            "<<<<<<< SEARCH\nbefore\x0cafter\n=======\nreplaced\n>>>>>>> REPLACE"
+        )
+
+        blocks = parse_search_replace_blocks(patch_content)
+
+        assert blocks == [("before\x0cafter", "replaced")]
 
-        # Create malformed patch missing replace marker
+    def test_parse_search_replace_blocks_inline_markers_in_body(self):
+        """Test that marker text embedded inside a body line is rejected."""
+        patch_content = """<<<<<<< SEARCH
+a <<<<<<< SEARCH b ======= c >>>>>>> REPLACE
+=======
+replacement
+>>>>>>> REPLACE"""
+
+        with pytest.raises(ValueError, match="Search text contains patch markers"):
+            parse_search_replace_blocks(patch_content)
+
+    def test_parse_search_replace_blocks_inline_markers_in_later_replace(self):
+        """Test that inline markers are found in the replace text of a later block."""
+        patch_content = """<<<<<<< SEARCH
+one
+=======
+uno
+>>>>>>> REPLACE
+<<<<<<< SEARCH
+two
+=======
+x <<<<<<< SEARCH y ======= z >>>>>>> REPLACE
+>>>>>>> REPLACE"""
+
+        with pytest.raises(
+            ValueError, match="Block 2: Replace text contains patch markers"
+        ):
+            parse_search_replace_blocks(patch_content)
+
+    def test_parse_search_replace_blocks_missing_separator(self):
+        """Test parsing with missing separator marker."""
+        patch_content = """<<<<<<< SEARCH
+content without separator
+>>>>>>> REPLACE"""
+
+        with pytest.raises(ValueError, match="Unbalanced markers"):
+            parse_search_replace_blocks(patch_content)
+
+    def test_parse_search_replace_blocks_missing_replace_marker(self):
+        """Test parsing with missing replace marker."""
         patch_content = """<<<<<<< SEARCH
 content
 =======
 replacement content"""
 
-        # Mock re.findall to return empty to trigger fallback
-        with patch("patch_file_mcp.server.re.findall", return_value=[]):
-            with pytest.raises(ValueError, match="Unbalanced markers"):
-                parse_search_replace_blocks(patch_content)
+        with pytest.raises(ValueError, match="Unbalanced markers"):
+            parse_search_replace_blocks(patch_content)
 
-    def test_parse_search_replace_blocks_fallback_markers_in_search_content(self):
-        """Test fallback parsing when markers appear in search content."""
-        from unittest.mock import patch
+    def test_parse_search_replace_blocks_incorrect_sequence(self):
+        """Test that the parser reports out-of-order markers like validate_block_integrity."""
+        patch_content = """<<<<<<< SEARCH
+first
+=======
+first replacement
+>>>>>>> REPLACE
+=======
+second
+<<<<<<< SEARCH
+second replacement
+>>>>>>> REPLACE"""
 
-        # Create patch with markers in search content (should be rejected)
+        with pytest.raises(ValueError, match="Incorrect marker sequence at position 3"):
+            parse_search_replace_blocks(patch_content)
+
+    def test_parse_search_replace_blocks_markers_in_search_content(self):
+        """Test parsing when markers appear in search content."""
         patch_content = """<<<<<<< SEARCH
 This content has ======= in it
 =======
 This replacement is fine
 >>>>>>> REPLACE"""
 
-        # Mock re.findall to return empty to trigger fallback
-        with patch("patch_file_mcp.server.re.findall", return_value=[]):
-            with pytest.raises(ValueError, match="Unbalanced markers"):
-                parse_search_replace_blocks(patch_content)
-
-    def test_parse_search_replace_blocks_fallback_markers_in_replace_content(self):
-        """Test fallback parsing when markers appear in replace content."""
-        from unittest.mock import patch
+        with pytest.raises(ValueError, match="Unbalanced markers"):
+            parse_search_replace_blocks(patch_content)
 
-        # Create patch with markers in replace content (should be rejected)
+    def test_parse_search_replace_blocks_markers_in_replace_content(self):
+        """Test parsing when markers appear in replace content."""
         patch_content = """<<<<<<< SEARCH
 This search is fine
 =======
 This replacement has >>>>>>> REPLACE in it
 >>>>>>> REPLACE"""
 
-        # Mock re.findall to return empty to trigger fallback
-        with patch("patch_file_mcp.server.re.findall", return_value=[]):
-            with pytest.raises(ValueError, match="Unbalanced markers"):
-                parse_search_replace_blocks(patch_content)
+        with pytest.raises(ValueError, match="Unbalanced markers"):
+            parse_search_replace_blocks(patch_content)
+
+
+class TestServerImport:
+    """Test what importing the server module loads."""
+
+    def test_module_import_does_not_import_fastmcp(self):
+        """Test that fastmcp is only imported when the MCP server is created."""
+        import subprocess
+        import sys
+
+        code = (
+            "import sys\n"
+            "import patch_file_mcp.server\n"
+            "print('fastmcp' in sys.modules)\n"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+
+        assert result.stdout.split() == ["False"]
+
+    def test_create_mcp_server_registers_patch_file(self):
+        """Test that the tool is registered on the server created at startup."""
+        from unittest.mock import MagicMock, patch
+
+        from patch_file_mcp import server
+
+        mock_fastmcp = MagicMock()
+        with patch.dict("sys.modules", {"fastmcp": mock_fastmcp}):
+            created = server.create_mcp_server()
+
+        mock_fastmcp.FastMCP.assert_called_once_with(
+            name="Patch File MCP", instructions=server.MCP_INSTRUCTIONS
+        )
+        assert created is mock_fastmcp.FastMCP.return_value
+        created.tool.return_value.assert_called_once_with(server.patch_file)
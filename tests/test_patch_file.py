@@ -2,14 +2,21 @@
 Tests for the main patch_file function.
 """
 
+import logging
+import os
+import stat
+import time
+from pathlib import Path, PureWindowsPath
+
 import pytest
-from unittest.mock import patch
-from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
 
 # Import the function we want to test
 from patch_file_mcp.server import (
     patch_file,
+    apply_independent_blocks,
     is_binary_file_extension,
+    _validate_target,
     track_failed_edit,
     clear_failed_edit_history,
     get_failed_edit_info,
@@ -185,6 +192,68 @@ def hello():
                     in result
                 )
 
+    def test_patch_file_qa_summary_format(self, tmp_path):
+        """Test the exact layout of the QA summary for mixed tool results."""
+        test_file = tmp_path / "test.py"
+        test_file.write_text("x = 1\n")
+
+        patch_content = """<<<<<<< SEARCH
+x = 1
+=======
+x = 2
+>>>>>>> REPLACE"""
+
+        qa_results = {
+            "qa_performed": True,
+            "iterations_used": 1,
+            "ruff_status": "warnings",
+            "black_status": "failed",
+            "mypy_status": "failed",
+            "ruff_stdout": "",
+            "ruff_stderr": "",
+            "black_stdout": "",
+            "black_stderr": "",
+            "mypy_stdout": "test.py:1: error: Bad\n",
+            "mypy_stderr": "",
+            "errors": [],
+            "warnings": ["Ruff warnings: minor"],
+        }
+
+        with (
+            patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]),
+            patch(
+                "patch_file_mcp.server.find_venv_directory",
+                return_value="/fake/venv/bin/python",
+            ),
+            patch(
+                "patch_file_mcp.server.run_python_qa_pipeline", return_value=qa_results
+            ),
+            patch(
+                "patch_file_mcp.server.should_suppress_mypy_info", return_value=False
+            ),
+        ):
+            result = patch_file(str(test_file), patch_content)
+
+        cmd_path = (
+            "./.venv/Scripts/python.exe" if os.name == "nt" else "./.venv/bin/python"
+        )
+        expected = (
+            "\n\nQA Results:\n\n"
+            "Ruff: ⚠️ Warning\n"
+            "Black: ❌ Failed\n"
+            "MyPy: ❌ Failed\n"
+            "\nError Details:\n"
+            "\nBlack (failed with no output)\n"
+            "\nMyPy (failed):\n"
+            "test.py:1: error: Bad\n"
+            "\nPlease fix the issues and run the following commands manually:\n"
+            f"{cmd_path} -m black {test_file}\n"
+            f"{cmd_path} -m mypy {test_file}\n"
+            "\nAdditional Information:\n"
+            "- Ruff warnings: minor\n"
+        )
+        assert expected in result
+
     def test_patch_file_file_not_found(self, tmp_path):
         """Test patching non-existent file."""
         # Setup
@@ -274,6 +343,72 @@ def func2():
             assert 'return "one"' in content
             assert 'return "two"' in content
 
+    def test_patch_file_block_matches_earlier_replacement(self, tmp_path):
+        """Test that a block can match text introduced by an earlier block."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_text("alpha\nbeta\n")
+
+        patch_content = """<<<<<<< SEARCH
+alpha
+=======
+gamma
+>>>>>>> REPLACE
+<<<<<<< SEARCH
+gamma
+beta
+=======
+delta
+>>>>>>> REPLACE"""
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            result = patch_file(str(test_file), patch_content)
+
+        assert "Successfully applied 2 patch blocks" in result
+        assert test_file.read_text() == "delta\n"
+
+    def test_patch_file_crlf_file(self, tmp_path):
+        """Test that a CRLF file is matched with LF search text, as in text mode."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_bytes(b"first\r\nsecond\r\nthird\rfourth\n")
+
+        patch_content = """<<<<<<< SEARCH
+second
+third
+=======
+2nd
+3rd
+>>>>>>> REPLACE"""
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            result = patch_file(str(test_file), patch_content)
+
+        assert "Successfully applied 1 patch blocks" in result
+        assert test_file.read_text() == "first\n2nd\n3rd\nfourth\n"
+
+    def test_patch_file_skips_debug_messages_when_debug_disabled(self, tmp_path):
+        """Test that debug messages are not built unless DEBUG is enabled."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_text("alpha\n")
+        mock_logger = MagicMock()
+        mock_logger.isEnabledFor.return_value = False
+
+        patch_content = """<<<<<<< SEARCH
+alpha
+=======
+beta
+>>>>>>> REPLACE"""
+
+        with (
+            patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]),
+            patch("patch_file_mcp.server.logger", mock_logger),
+        ):
+            result = patch_file(str(test_file), patch_content)
+
+        assert "Successfully applied 1 patch blocks" in result
+        mock_logger.isEnabledFor.assert_any_call(logging.DEBUG)
+        mock_logger.debug.assert_not_called()
+        mock_logger.info.assert_called()
+
     def test_patch_file_no_matching_content(self, tmp_path):
         """Test patching when search text is not found."""
         # Setup
@@ -449,6 +584,142 @@ print('hi')
             with pytest.raises(RuntimeError, match="Failed to apply patch"):
                 patch_file(str(test_file), patch_content)
 
+    def test_patch_file_ambiguous_match_reports_count(self, tmp_path):
+        """Test that the ambiguity error reports how many times the text appears."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_text("x = 1\nx = 1\nx = 1\n")
+
+        patch_content = """<<<<<<< SEARCH
+x = 1
+=======
+x = 2
+>>>>>>> REPLACE"""
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            with pytest.raises(RuntimeError, match="appears 3 times"):
+                patch_file(str(test_file), patch_content)
+
+        assert test_file.read_text() == "x = 1\nx = 1\nx = 1\n"
+
+    def test_patch_file_overlapping_text_counts_as_one_match(self, tmp_path):
+        """Test that overlapping occurrences are not treated as ambiguous."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_text("aaa\n")
+
+        patch_content = """<<<<<<< SEARCH
+aa
+=======
+b
+>>>>>>> REPLACE"""
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            patch_file(str(test_file), patch_content)
+
+        assert test_file.read_text() == "ba\n"
+
+    def test_patch_file_no_op_skips_write_and_qa(self, tmp_path):
+        """Test that a patch leaving the content unchanged writes nothing and skips QA."""
+        test_file = tmp_path / "test.py"
+        test_file.write_text("def hello():\n    return 1\n")
+
+        patch_content = """<<<<<<< SEARCH
+    return 1
+=======
+    return 1
+>>>>>>> REPLACE"""
+
+        with (
+            patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]),
+            patch("patch_file_mcp.server.write_file_atomically") as mock_write,
+            patch("patch_file_mcp.server.find_venv_directory") as mock_find_venv,
+            patch("patch_file_mcp.server.run_python_qa_pipeline") as mock_qa,
+        ):
+            result = patch_file(str(test_file), patch_content)
+
+        assert "Successfully applied 1 patch blocks" in result
+        assert "content is unchanged" in result
+        assert "QA Results:" not in result
+        mock_write.assert_not_called()
+        mock_find_venv.assert_not_called()
+        mock_qa.assert_not_called()
+
+
+class TestApplyIndependentBlocks:
+    """Test cases for apply_independent_blocks."""
+
+    def test_independent_blocks_are_applied_in_one_pass(self):
+        """Test that non-interacting blocks are spliced into the original."""
+        content = "one\ntwo\nthree\n"
+        blocks = [("three", "3"), ("one", "1")]
+
+        assert apply_independent_blocks(content, blocks) == "1\ntwo\n3\n"
+
+    @pytest.mark.parametrize(
+        "content, blocks",
+        [
+            # Search text missing or ambiguous in the original
+            ("one\n", [("two", "2")]),
+            ("x x\n", [("x", "y")]),
+            # Overlapping matches
+            ("abcd", [("abc", "1"), ("bcd", "2")]),
+            # A later block matches text created by an earlier replacement
+            ("ab", [("b", "c"), ("ac", "d")]),
+            ("alpha beta", [("alpha", "gamma"), ("gamma", "delta")]),
+            # Empty search text
+            ("abc", [("", "x")]),
+        ],
+    )
+    def test_interacting_or_failing_blocks_are_left_to_sequential_apply(
+        self, content, blocks
+    ):
+        """Test that anything not provably independent returns None."""
+        assert apply_independent_blocks(content, blocks) is None
+
+
+class TestValidateTarget:
+    """Test cases for the combined checks on a patch target."""
+
+    def test_returns_resolved_path_and_stat(self, tmp_path):
+        """Test that a valid target yields its resolved path and stat result."""
+        test_file = tmp_path / "notes.txt"
+        test_file.write_text("content\n")
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            pp, file_stat = _validate_target(str(test_file))
+
+        assert pp == test_file.resolve()
+        assert file_stat.st_size == len("content\n")
+
+    @pytest.mark.parametrize(
+        "file_path, error",
+        [
+            ("relative/notes.txt", ValueError),
+            (None, ValueError),
+            ("/outside/notes.txt", PermissionError),
+        ],
+    )
+    def test_rejects_invalid_targets(self, tmp_path, file_path, error):
+        """Test that each failing check raises its own error type."""
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            with pytest.raises(error):
+                _validate_target(file_path)
+
+    @pytest.mark.parametrize("file_path", ["/notes.txt", "\\notes.txt"])
+    def test_rejects_driveless_rooted_path_on_windows(self, tmp_path, file_path):
+        """Test that a rooted path without a drive is relative on Windows."""
+        with (
+            patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]),
+            patch("patch_file_mcp.server.Path", PureWindowsPath),
+        ):
+            with pytest.raises(ValueError, match="relative path"):
+                _validate_target(file_path)
+
+    def test_rejects_directory(self, tmp_path):
+        """Test that a directory is not accepted as a patch target."""
+        with patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]):
+            with pytest.raises(FileNotFoundError):
+                _validate_target(str(tmp_path / "."))
+
 
 class TestBinaryFileSecurity:
     """Test cases for binary file extension security checks."""
@@ -523,6 +794,23 @@ class TestBinaryFileSecurity:
         assert is_binary_file_extension("/path/to/file") == (False, None)
         assert is_binary_file_extension("/path/to/file.") == (False, None)
 
+    @pytest.mark.parametrize(
+        "file_path",
+        [
+            "/path/to/.exe",
+            "/path/to/file.",
+            "/path/to/archive.tar.gz",
+            "/path.exe/to/file",
+            "/path/to/file.exe/",
+            "relative/file.PNG",
+        ],
+    )
+    def test_is_binary_file_extension_matches_path_suffix(self, file_path):
+        """Test that the extension is the one Path.suffix would report."""
+        suffix = Path(file_path).suffix.lower()
+        expected = (True, suffix) if suffix else (False, None)
+        assert is_binary_file_extension(file_path) == expected
+
     def test_is_binary_file_extension_handles_malformed_paths(self):
         """Test that malformed paths are handled safely."""
         # Should return True (binary) for safety when path parsing fails
@@ -597,9 +885,9 @@ Hello Universe
 
     def test_is_binary_file_extension_exception_handling(self):
         """Test exception handling in is_binary_file_extension."""
-        # Mock Path to raise an exception
-        with patch("pathlib.Path") as mock_path:
-            mock_path.side_effect = Exception("Unexpected error")
+        # Mock the suffix extraction to raise an exception
+        with patch("patch_file_mcp.server.os.path.splitext") as mock_splitext:
+            mock_splitext.side_effect = Exception("Unexpected error")
 
             result = is_binary_file_extension("/some/path/file.txt")
 
@@ -702,6 +990,21 @@ modified
             with pytest.raises(RuntimeError, match="Failed to apply patch"):
                 patch_file(str(test_file), None)
 
+    def test_patch_file_without_markers_skips_file_read(self, tmp_path):
+        """Test that patch content without markers fails before reading the file."""
+        test_file = tmp_path / "test.txt"
+        test_file.write_text("content")
+
+        with (
+            patch("patch_file_mcp.server.allowed_directories", [str(tmp_path)]),
+            patch("builtins.open", side_effect=AssertionError("file was read")),
+        ):
+            with pytest.raises(RuntimeError, match="Invalid patch format"):
+                patch_file(str(test_file), "content\n=======\nmodified")
+
+        history = FAILED_EDITS_HISTORY[str(test_file)]
+        assert history[-1]["failure_stage"] == "patch_parsing"
+
     def test_patch_file_with_nonexistent_allowed_directory(self, tmp_path):
         """Test patch_file when allowed directory doesn't exist during validation."""
         test_file = tmp_path / "test.txt"
@@ -721,6 +1024,114 @@ modified
                 patch_file(str(test_file), patch_content)
 
 
+class TestAtomicWrite:
+    """Test cases for write_file_atomically."""
+
+    def test_write_replaces_content_without_leftovers(self, tmp_path):
+        """Test that content is replaced and no temporary file remains."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "module.py"
+        target.write_text("old\n")
+
+        write_file_atomically(str(target), "new\n")
+
+        assert target.read_text() == "new\n"
+        assert [p.name for p in tmp_path.iterdir()] == ["module.py"]
+
+    @pytest.mark.skipif(os.name == "nt", reason="POSIX permission bits")
+    def test_write_applies_given_mode(self, tmp_path):
+        """Test that the original permission bits are carried over."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "script.sh"
+        target.write_text("echo old\n")
+        target.chmod(0o755)
+
+        write_file_atomically(str(target), "echo new\n", 0o755)
+
+        assert stat.S_IMODE(target.stat().st_mode) == 0o755
+
+    def test_write_falls_back_when_replace_is_refused(self, tmp_path):
+        """Test the in-place fallback when os.replace raises PermissionError."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "locked.txt"
+        target.write_text("old\n")
+
+        with patch(
+            "patch_file_mcp.server.os.replace",
+            side_effect=PermissionError("file in use"),
+        ):
+            write_file_atomically(str(target), "new\n")
+
+        assert target.read_text() == "new\n"
+        assert [p.name for p in tmp_path.iterdir()] == ["locked.txt"]
+
+    def test_write_error_removes_temporary_file(self, tmp_path):
+        """Test that a failed write leaves the original file and no leftovers."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "data.txt"
+        target.write_text("old\n")
+
+        with patch("patch_file_mcp.server.os.fsync", side_effect=OSError("disk full")):
+            with pytest.raises(OSError, match="disk full"):
+                write_file_atomically(str(target), "new\n")
+
+        assert target.read_text() == "old\n"
+        assert [p.name for p in tmp_path.iterdir()] == ["data.txt"]
+
+    def test_write_refuses_file_without_write_access(self, tmp_path):
+        """Test that a file the process may not write is left untouched."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "readonly.txt"
+        target.write_text("old\n")
+
+        with patch("patch_file_mcp.server.os.access", return_value=False):
+            with pytest.raises(PermissionError, match="Permission denied"):
+                write_file_atomically(str(target), "new\n")
+
+        assert target.read_text() == "old\n"
+        assert [p.name for p in tmp_path.iterdir()] == ["readonly.txt"]
+
+    @pytest.mark.skipif(
+        os.name == "nt" or os.geteuid() == 0,
+        reason="POSIX permission bits; root may write read-only files",
+    )
+    def test_write_refuses_read_only_file(self, tmp_path):
+        """Test that a 0444 file is not replaced through its directory."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "readonly.txt"
+        target.write_text("old\n")
+        target.chmod(0o444)
+
+        with pytest.raises(PermissionError, match="Permission denied"):
+            write_file_atomically(str(target), "new\n")
+
+        assert target.read_text() == "old\n"
+
+    def test_write_keeps_hard_links(self, tmp_path):
+        """Test that a hard-linked file is rewritten in place."""
+        from patch_file_mcp.server import write_file_atomically
+
+        target = tmp_path / "shared.txt"
+        target.write_text("old\n")
+        link = tmp_path / "link.txt"
+        try:
+            os.link(target, link)
+        except (OSError, NotImplementedError):
+            pytest.skip("Hard links are not supported here")
+        inode = target.stat().st_ino
+
+        write_file_atomically(str(target), "new\n")
+
+        assert target.stat().st_ino == inode
+        assert link.read_text() == "new\n"
+
+
 class TestFailedEditTracking:
     """Test cases for failed edit tracking functionality."""
 
@@ -748,6 +1159,21 @@ class TestFailedEditTracking:
         hash4 = create_patch_params_hash("/different/path.py", patch_content)
         assert hash1 != hash4
 
+    def test_create_patch_params_hash_matches_joined_parameters(self):
+        """Test the hash equals the BLAKE2b of the '|'-joined parameters."""
+        import hashlib
+
+        expected = hashlib.blake2b(
+            "/path/to/file.py|patch ✓".encode("utf-8"), digest_size=16
+        )
+
+        assert create_patch_params_hash("/path/to/file.py", "patch ✓") == (
+            expected.hexdigest()
+        )
+        assert create_patch_params_hash("/path/to/file.py", None) == (
+            hashlib.blake2b(b"/path/to/file.py|None", digest_size=16).hexdigest()
+        )
+
     def test_track_failed_edit(self):
         """Test tracking failed edit attempts."""
         file_path = "/path/to/test.py"
@@ -772,7 +1198,7 @@ new content
         assert attempt["failure_stage"] == "test_failure"
         assert attempt["error_message"] == "Test error message"
         assert "params_hash" in attempt
-        assert "datetime" in attempt
+        assert "timestamp" in attempt
 
     def test_track_failed_edit_multiple_attempts(self):
         """Test tracking multiple failed attempts."""
@@ -812,6 +1238,7 @@ new content
         # Should keep the most recent ones
         assert FAILED_EDITS_HISTORY[file_path][0]["failure_stage"] == "failure2"
         assert FAILED_EDITS_HISTORY[file_path][-1]["failure_stage"] == "failure11"
+        assert FAILED_EDITS_HISTORY[file_path].maxlen == 10
 
     def test_clear_failed_edit_history(self):
         """Test clearing failed edit history."""
@@ -834,6 +1261,28 @@ new content
         # Verify it's cleared
         assert file_path not in FAILED_EDITS_HISTORY
 
+    def test_track_failed_edit_uses_known_block_count(self):
+        """Test that a block count supplied by the caller skips re-parsing."""
+        file_path = "/path/to/test.py"
+
+        with patch("patch_file_mcp.server.parse_search_replace_blocks") as mock_parse:
+            track_failed_edit(file_path, "patch", "block_application", "Error", 3)
+
+        mock_parse.assert_not_called()
+        assert FAILED_EDITS_HISTORY[file_path][0]["block_count"] == 3
+
+    def test_get_failed_edit_info_skips_parse_before_third_attempt(self):
+        """Test that the patch is only parsed when the block count matters."""
+        file_path = "/path/to/test.py"
+        track_failed_edit(file_path, "patch", "failure1", "Error1", 1)
+        track_failed_edit(file_path, "patch", "failure2", "Error2", 1)
+
+        with patch("patch_file_mcp.server.parse_search_replace_blocks") as mock_parse:
+            result = get_failed_edit_info(file_path, "patch")
+
+        mock_parse.assert_not_called()
+        assert "2nd consecutive failed edit attempt" in result
+
     def test_get_failed_edit_info_no_history(self):
         """Test getting awareness info when no failed attempts exist."""
         file_path = "/path/to/test.py"
@@ -1014,13 +1463,13 @@ new content
         # No need for patch content in this test
 
         # Create attempts with different timestamps
-        old_datetime = datetime.now() - timedelta(hours=2)  # 2 hours ago
-        recent_datetime = datetime.now() - timedelta(minutes=30)  # 30 minutes ago
+        old_timestamp = time.monotonic() - 2 * 3600  # 2 hours ago
+        recent_timestamp = time.monotonic() - 30 * 60  # 30 minutes ago
 
         # Add old attempt
         FAILED_EDITS_HISTORY[file_path] = [
             {
-                "datetime": old_datetime,
+                "timestamp": old_timestamp,
                 "filename": file_path,
                 "block_count": 1,
                 "failure_stage": "test_failure",
@@ -1033,7 +1482,7 @@ new content
         recent_file = "/path/to/recent.py"
         FAILED_EDITS_HISTORY[recent_file] = [
             {
-                "datetime": recent_datetime,
+                "timestamp": recent_timestamp,
                 "filename": recent_file,
                 "block_count": 1,
                 "failure_stage": "test_failure",
@@ -1060,12 +1509,12 @@ new content
         file_path = "/path/to/test.py"
 
         # Create mixed old and recent attempts for same file
-        old_datetime = datetime.now() - timedelta(hours=2)
-        recent_datetime = datetime.now() - timedelta(minutes=30)
+        old_timestamp = time.monotonic() - 2 * 3600
+        recent_timestamp = time.monotonic() - 30 * 60
 
         FAILED_EDITS_HISTORY[file_path] = [
             {
-                "datetime": old_datetime,
+                "timestamp": old_timestamp,
                 "filename": file_path,
                 "block_count": 1,
                 "failure_stage": "old_failure",
@@ -1073,7 +1522,7 @@ new content
                 "params_hash": "hash1",
             },
             {
-                "datetime": recent_datetime,
+                "timestamp": recent_timestamp,
                 "filename": file_path,
                 "block_count": 1,
                 "failure_stage": "recent_failure",
@@ -1089,6 +1538,20 @@ new content
         assert file_path in FAILED_EDITS_HISTORY
         assert len(FAILED_EDITS_HISTORY[file_path]) == 1
         assert FAILED_EDITS_HISTORY[file_path][0]["failure_stage"] == "recent_failure"
+        # The rebuilt history keeps the per-file cap
+        assert FAILED_EDITS_HISTORY[file_path].maxlen == 10
+
+    def test_garbage_collection_skips_recent_histories(self):
+        """Test that a history whose oldest attempt is recent is left untouched."""
+        file_path = "/path/to/test.py"
+        track_failed_edit(file_path, "patch", "failure1", "Error 1", block_count=0)
+        track_failed_edit(file_path, "patch", "failure2", "Error 2", block_count=0)
+        history = FAILED_EDITS_HISTORY[file_path]
+
+        garbage_collect_failed_edit_history()
+
+        assert FAILED_EDITS_HISTORY[file_path] is history
+        assert len(history) == 2
 
     def test_successful_edit_always_clears_history(self):
         """Test that ANY successful edit clears ALL failed edit history for that file."""
@@ -1132,10 +1595,10 @@ new2
         file_path.write_text("content")
 
         # Mock old entries
-        old_datetime = datetime.now() - timedelta(hours=2)
+        old_timestamp = time.monotonic() - 2 * 3600
         FAILED_EDITS_HISTORY[str(file_path)] = [
             {
-                "datetime": old_datetime,
+                "timestamp": old_timestamp,
                 "filename": str(file_path),
                 "block_count": 1,
                 "failure_stage": "old_failure",
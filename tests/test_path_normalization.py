@@ -2,6 +2,8 @@
 Comprehensive tests for path normalization functionality.
 """
 
+import os
+
 import pytest
 from pathlib import Path
 from unittest.mock import patch
@@ -195,6 +197,44 @@ class TestPathNormalization:
             ):
                 normalize_path("/some/path")
 
+    def test_normalize_path_caches_string_work_but_resolves_each_time(self, tmp_path):
+        """Test that only the string normalization is cached, not resolution."""
+        from patch_file_mcp.server import _normalize_path_string
+
+        link = tmp_path / "link"
+        first_target = tmp_path / "first"
+        second_target = tmp_path / "second"
+        first_target.mkdir()
+        second_target.mkdir()
+        try:
+            link.symlink_to(first_target, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            pytest.skip("Symlinks are not supported on this platform")
+
+        # Use the separator that needs converting, so the string work is done
+        path_str = f"{link}/file.txt" if os.name == "nt" else f"{link}\\file.txt"
+        _normalize_path_string.cache_clear()
+
+        assert normalize_path(path_str) == first_target.resolve() / "file.txt"
+
+        # Repoint the symlink: the cached string work must not pin the target
+        link.unlink()
+        link.symlink_to(second_target, target_is_directory=True)
+
+        assert normalize_path(path_str) == second_target.resolve() / "file.txt"
+        assert _normalize_path_string.cache_info().hits == 1
+
+    @pytest.mark.skipif(os.name == "nt", reason="POSIX separators")
+    def test_normalize_path_skips_string_work_for_native_paths(self, tmp_path):
+        """Test that a path already in native form goes straight to resolution."""
+        with patch(
+            "patch_file_mcp.server._normalize_path_string"
+        ) as mock_normalize_string:
+            result = normalize_path(f"{tmp_path}/file.txt")
+
+        mock_normalize_string.assert_not_called()
+        assert result == tmp_path.resolve() / "file.txt"
+
 
 class TestDirectoryAccessValidation:
     """Tests for directory access validation functionality."""
@@ -229,13 +269,15 @@ class TestDirectoryAccessValidation:
         test_dir = tmp_path / "no_read_access"
         test_dir.mkdir()
 
-        # Mock Path.iterdir() to raise PermissionError
-        def mock_iterdir(self):
-            if str(test_dir) in str(self):
-                raise PermissionError("Permission denied")
-            return []
+        # Mock os.access() to deny read access
+        original_access = os.access
 
-        monkeypatch.setattr("pathlib.Path.iterdir", mock_iterdir)
+        def mock_access(path, mode, **kwargs):
+            if str(test_dir) in str(path) and mode & os.R_OK:
+                return False
+            return original_access(path, mode, **kwargs)
+
+        monkeypatch.setattr("patch_file_mcp.server.os.access", mock_access)
 
         is_valid, error_msg = validate_directory_access(test_dir)
 
@@ -249,15 +291,15 @@ class TestDirectoryAccessValidation:
         test_dir = tmp_path / "no_write_access"
         test_dir.mkdir()
 
-        # Mock write_text to raise PermissionError
-        original_write_text = Path.write_text
+        # Mock os.access() to deny write access
+        original_access = os.access
 
-        def mock_write_text(self, content, **kwargs):
-            if str(test_dir) in str(self):
-                raise PermissionError("Permission denied")
-            return original_write_text(self, content, **kwargs)
+        def mock_access(path, mode, **kwargs):
+            if str(test_dir) in str(path) and mode & os.W_OK:
+                return False
+            return original_access(path, mode, **kwargs)
 
-        monkeypatch.setattr("pathlib.Path.write_text", mock_write_text)
+        monkeypatch.setattr("patch_file_mcp.server.os.access", mock_access)
 
         is_valid, error_msg = validate_directory_access(test_dir)
 
@@ -288,3 +330,156 @@ class TestDirectoryAccessValidation:
 
         assert is_valid is True
         assert error_msg is None
+
+    def test_validate_directory_access_leaves_directory_untouched(self, tmp_path):
+        """Test that validation does not create files in the directory."""
+        from patch_file_mcp.server import validate_directory_access
+
+        test_dir = tmp_path / "valid_dir"
+        test_dir.mkdir()
+        before = os.stat(test_dir).st_mtime_ns
+
+        is_valid, _ = validate_directory_access(test_dir)
+
+        assert is_valid is True
+        assert list(test_dir.iterdir()) == []
+        assert os.stat(test_dir).st_mtime_ns == before
+
+
+class TestAllowedDirectoryContainment:
+    """Tests for the allowed-directory containment check."""
+
+    def test_file_in_allowed_directory(self, tmp_path):
+        """Test that files in an allowed directory and its subdirectories pass."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        nested_file = tmp_path / "pkg" / "module.py"
+
+        assert is_file_in_allowed_directories(str(nested_file), [str(tmp_path)]) == (
+            True,
+            str(tmp_path),
+        )
+
+    def test_sibling_with_common_prefix_is_rejected(self, tmp_path):
+        """Test that a sibling directory sharing a name prefix is not accepted."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        allowed_dir = tmp_path / "user"
+        sibling_file = tmp_path / "userX" / "file.py"
+
+        assert is_file_in_allowed_directories(
+            str(sibling_file), [str(allowed_dir)]
+        ) == (False, None)
+
+    def test_matches_any_of_multiple_directories(self, tmp_path):
+        """Test that the matching allowed directory is reported."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        first_dir = tmp_path / "first"
+        second_dir = tmp_path / "second"
+        target_file = second_dir / "file.py"
+
+        assert is_file_in_allowed_directories(
+            str(target_file), [str(first_dir), str(second_dir)]
+        ) == (True, str(second_dir))
+
+    def test_parent_traversal_is_rejected(self, tmp_path):
+        """Test that '..' components cannot escape an allowed directory."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        allowed_dir = tmp_path / "allowed"
+        escaping_file = f"{allowed_dir}/../outside.py"
+
+        assert is_file_in_allowed_directories(escaping_file, [str(allowed_dir)]) == (
+            False,
+            None,
+        )
+
+    def test_allowed_directory_itself_is_accepted(self, tmp_path):
+        """Test that the allowed directory path itself is contained."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        assert is_file_in_allowed_directories(str(tmp_path), [str(tmp_path)]) == (
+            True,
+            str(tmp_path),
+        )
+
+    def test_nested_allowed_directories(self, tmp_path):
+        """Test files under nested allowed directories resolve to the outer one."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        outer = tmp_path / "a"
+        inner = outer / "b"
+        allowed = [str(inner), str(outer)]
+
+        assert is_file_in_allowed_directories(str(inner / "f.py"), allowed) == (
+            True,
+            str(outer),
+        )
+        assert is_file_in_allowed_directories(str(outer / "c" / "f.py"), allowed) == (
+            True,
+            str(outer),
+        )
+        assert is_file_in_allowed_directories(str(tmp_path / "f.py"), allowed) == (
+            False,
+            None,
+        )
+
+    def test_many_allowed_directories(self, tmp_path):
+        """Test lookups against a large set of allowed directories."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        allowed = [str(tmp_path / f"project{i}") for i in range(50)]
+
+        for i in (0, 7, 10, 49):
+            target = tmp_path / f"project{i}" / "src" / "main.py"
+            assert is_file_in_allowed_directories(str(target), allowed) == (
+                True,
+                allowed[i],
+            )
+        assert is_file_in_allowed_directories(
+            str(tmp_path / "project5x" / "main.py"), allowed
+        ) == (False, None)
+        assert is_file_in_allowed_directories(
+            str(tmp_path / "project50" / "main.py"), allowed
+        ) == (False, None)
+
+    def test_index_is_reused_until_directories_change(self, tmp_path):
+        """Test that the prefix index is only rebuilt for a new directory list."""
+        from patch_file_mcp import server
+
+        allowed = [str(tmp_path / "a")]
+        target = str(tmp_path / "a" / "f.py")
+        build = server._build_allowed_directory_index
+
+        with patch.object(
+            server, "_build_allowed_directory_index", side_effect=build
+        ) as mock_build:
+            server.is_file_in_allowed_directories(target, allowed)
+            server.is_file_in_allowed_directories(target, allowed)
+            assert mock_build.call_count == 1
+
+            replaced = [str(tmp_path / "b")]
+            assert server.is_file_in_allowed_directories(target, replaced) == (
+                False,
+                None,
+            )
+            assert mock_build.call_count == 2
+
+    def test_index_follows_in_place_changes(self, tmp_path):
+        """Test that editing the directory list in place changes what is allowed."""
+        from patch_file_mcp.server import is_file_in_allowed_directories
+
+        first = str(tmp_path / "first")
+        second = str(tmp_path / "second")
+        in_first = str(tmp_path / "first" / "f.py")
+        in_second = str(tmp_path / "second" / "f.py")
+        allowed = [first]
+        assert is_file_in_allowed_directories(in_first, allowed) == (True, first)
+
+        allowed[:] = [second]
+        assert is_file_in_allowed_directories(in_first, allowed) == (False, None)
+        assert is_file_in_allowed_directories(in_second, allowed) == (True, second)
+
+        allowed.append(first)
+        assert is_file_in_allowed_directories(in_first, allowed) == (True, first)
@@ -2,8 +2,12 @@
 Tests for QA pipeline functionality.
 """
 
+import sys
+import time
+
 import pytest
-from unittest.mock import patch
+from concurrent.futures import Future
+from unittest.mock import MagicMock, patch
 
 # Import the functions we want to test
 from patch_file_mcp import server as pf_server
@@ -515,3 +519,342 @@ def test_function():
             # Restore original values
             pf_server.SKIP_MYPY = original_skip_mypy
             pf_server.SKIP_MYPY_ON_TESTS = original_skip_mypy_on_tests
+
+
+class TestQAPipelineToolSelection:
+    """Test cases for running a subset of the QA tools."""
+
+    @staticmethod
+    def _tools_called(mock_run):
+        return sorted(call.args[0][2] for call in mock_run.call_args_list)
+
+    @pytest.mark.parametrize(
+        "skipped, expected_tools",
+        [
+            ("SKIP_BLACK", ["mypy", "ruff"]),
+            ("SKIP_RUFF", ["black", "mypy"]),
+        ],
+    )
+    def test_single_formatter_still_runs_mypy(
+        self, tmp_path, mock_subprocess_run, skipped, expected_tools
+    ):
+        """Test that mypy runs when only one of ruff and black is enabled."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("x = 1\n")
+
+        with patch.object(pf_server, skipped, True):
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert self._tools_called(mock_subprocess_run) == expected_tools
+        assert result["mypy_status"] == "passed"
+        assert result["warnings"] == []
+
+    def test_mypy_only(self, tmp_path, mock_subprocess_run):
+        """Test that mypy runs when both formatters are disabled."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("x = 1\n")
+
+        with (
+            patch.object(pf_server, "SKIP_RUFF", True),
+            patch.object(pf_server, "SKIP_BLACK", True),
+        ):
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert self._tools_called(mock_subprocess_run) == ["mypy"]
+        assert result["mypy_status"] == "passed"
+        assert result["warnings"] == []
+
+
+class TestQAPipelineConcurrentMypy:
+    """Test cases for running mypy alongside ruff and black."""
+
+    @staticmethod
+    def _count_commands(mock_run):
+        counts = {"ruff": 0, "black": 0, "mypy": 0}
+        for call in mock_run.call_args_list:
+            # Only look at the tool part; the file path may contain tool names
+            tool_args = call.args[0][:-2]
+            for tool in counts:
+                if any(tool in arg for arg in tool_args):
+                    counts[tool] += 1
+        return counts
+
+    def test_mypy_runs_once_when_file_unchanged(self, tmp_path, mock_subprocess_run):
+        """Test that the background mypy result is used when ruff/black change nothing."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        with patch(
+            "patch_file_mcp.server.get_file_content_digest", return_value=b"digest"
+        ):
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert result["mypy_status"] == "passed"
+        assert self._count_commands(mock_subprocess_run)["mypy"] == 1
+
+    def test_mypy_reruns_when_black_reformats(self, tmp_path, mock_qa_pipeline_complex):
+        """Test that mypy is run again when the file changed while it was running."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        # The background run saw the pre-black content and reports a failure
+        stale_result: Future = Future()
+        stale_result.set_result((False, "stale mypy error", "", 1))
+        mock_executor = MagicMock()
+        mock_executor.submit.return_value = stale_result
+
+        with patch("patch_file_mcp.server.get_qa_executor", return_value=mock_executor):
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        mock_executor.submit.assert_called_once()
+        assert result["mypy_status"] == "passed"
+        assert result["mypy_stdout"] == ""
+        assert self._count_commands(mock_qa_pipeline_complex)["mypy"] == 1
+
+    def test_mypy_failure_from_background_run_is_reported(
+        self, tmp_path, mock_subprocess_run
+    ):
+        """Test that a mypy failure from the background run reaches the results."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f() -> int:\n    return 'x'\n")
+
+        def mock_run(cmd, cwd=None, timeout=30, shell=False, env=None):
+            if "mypy" in cmd[:-2]:
+                return (False, "module.py:2: error: bad return", "", 1)
+            return (True, "", "", 0)
+
+        mock_subprocess_run.side_effect = mock_run
+
+        with patch(
+            "patch_file_mcp.server.get_file_content_digest", return_value=b"digest"
+        ):
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert result["mypy_status"] == "failed"
+        assert "bad return" in result["mypy_stdout"]
+
+    def test_stale_background_run_is_stopped(self, tmp_path, mock_qa_pipeline_complex):
+        """Test that the background mypy run is stopped when black changed the file."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        with patch.object(pf_server._BackgroundCommand, "stop", autospec=True) as stop:
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert stop.called
+        assert result["mypy_status"] == "passed"
+
+    def test_early_return_stops_background_run(self, tmp_path, mock_subprocess_run):
+        """Test that returning before mypy's result is used stops the background run."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        def mock_run(cmd, cwd=None, timeout=30, shell=False, env=None):
+            if "ruff" in cmd[:-2]:
+                return (False, "", "Command timed out after 15 seconds", -1)
+            return (True, "", "", 0)
+
+        mock_subprocess_run.side_effect = mock_run
+
+        with patch.object(pf_server._BackgroundCommand, "stop", autospec=True) as stop:
+            result = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert result["ruff_status"] == "failed"
+        assert result["mypy_status"] is None
+        stop.assert_called_once()
+
+
+class TestBackgroundCommand:
+    """Test cases for QA commands run in the worker pool."""
+
+    def test_result_of_finished_command(self):
+        """Test that the command's output is returned like a foreground run."""
+        command = pf_server._BackgroundCommand(
+            [sys.executable, "-c", "print('ok')"], timeout=30
+        )
+
+        assert command.result() == (True, "ok\n", "", 0)
+        # Stopping a finished command is harmless
+        command.stop()
+
+    def test_stop_terminates_running_process(self):
+        """Test that stopping a started command terminates its process."""
+        command = pf_server._BackgroundCommand(
+            [sys.executable, "-c", "import time; time.sleep(60)"], timeout=120
+        )
+        deadline = time.monotonic() + 10
+        while command._process is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        process = command._process
+        assert process is not None
+
+        started = time.monotonic()
+        command.stop()
+
+        assert process.poll() is not None
+        assert time.monotonic() - started < 10
+        success, _, _, return_code = command.result()
+        assert not success
+        assert return_code != 0
+
+    def test_timeout_kills_process(self):
+        """Test that a command running past its timeout is killed and reported."""
+        command = pf_server._BackgroundCommand(
+            [sys.executable, "-c", "import time; time.sleep(60)"], timeout=0.5
+        )
+
+        assert command.result() == (
+            False,
+            "",
+            "Command timed out after 0.5 seconds",
+            -1,
+        )
+        assert command._process.poll() is not None
+
+    def test_missing_executable_is_reported(self, tmp_path):
+        """Test that a command that cannot be started reports the failure."""
+        command = pf_server._BackgroundCommand([str(tmp_path / "missing")])
+
+        success, stdout, stderr, return_code = command.result()
+
+        assert (success, stdout, return_code) == (False, "", -1)
+        assert stderr.startswith("Command execution failed:")
+
+
+class TestQAPipelineFormatCache:
+    """Test cases for skipping ruff/black on content they already accepted."""
+
+    @staticmethod
+    def _tools_called(mock_run):
+        return [call.args[0][2] for call in mock_run.call_args_list]
+
+    def test_unchanged_content_skips_ruff_and_black(
+        self, tmp_path, mock_subprocess_run
+    ):
+        """Test that a second run on the same content only runs mypy."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        first = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+        mock_subprocess_run.reset_mock()
+        second = run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert self._tools_called(mock_subprocess_run) == ["mypy"]
+        for key in ("ruff_status", "black_status", "mypy_status", "warnings"):
+            assert second[key] == first[key]
+
+    def test_changed_content_runs_ruff_and_black_again(
+        self, tmp_path, mock_subprocess_run
+    ):
+        """Test that new content is checked by ruff and black again."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+        test_file.write_text("def g():\n    pass\n")
+        mock_subprocess_run.reset_mock()
+        run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert sorted(self._tools_called(mock_subprocess_run)) == [
+            "black",
+            "mypy",
+            "ruff",
+        ]
+
+    def test_updated_tool_runs_again(self, tmp_path, mock_subprocess_run):
+        """Test that reinstalling a formatter invalidates its cached outcome."""
+        python_exe = tmp_path / "python.exe"
+        python_exe.write_text("# Mock python")
+        black_bin = tmp_path / ("black.exe" if pf_server.os.name == "nt" else "black")
+        black_bin.write_text("# Mock black")
+        test_file = tmp_path / "module.py"
+        test_file.write_text("def f():\n    pass\n")
+
+        run_python_qa_pipeline(str(test_file), str(python_exe))
+        black_bin.write_text("# Mock black, upgraded")
+        mock_subprocess_run.reset_mock()
+        run_python_qa_pipeline(str(test_file), str(python_exe))
+
+        commands = [call.args[0] for call in mock_subprocess_run.call_args_list]
+        assert [str(black_bin), "--quiet", "--", str(test_file)] in commands
+
+    def test_cache_is_bounded(self, tmp_path, mock_subprocess_run):
+        """Test that the least recently used entries are evicted."""
+        test_file = tmp_path / "module.py"
+
+        with patch.object(pf_server, "QA_FORMAT_CACHE_SIZE", 2):
+            for i in range(3):
+                test_file.write_text(f"x = {i}\n")
+                run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+            assert len(pf_server.QA_FORMAT_CACHE) <= 2
+            test_file.write_text("x = 0\n")
+            mock_subprocess_run.reset_mock()
+            run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        assert "ruff" in self._tools_called(mock_subprocess_run)
+
+
+class TestQAToolCommand:
+    """Test cases for resolving how QA tools are launched."""
+
+    @staticmethod
+    def _tool_name(tool):
+        return f"{tool}.exe" if pf_server.os.name == "nt" else tool
+
+    def test_prefers_tool_next_to_interpreter(self, tmp_path):
+        """Test that the tool's entry point in the venv is used when present."""
+        python_exe = str(tmp_path / "python.exe")
+        tool_bin = tmp_path / self._tool_name("ruff")
+        tool_bin.write_text("# Mock ruff")
+
+        assert pf_server._qa_tool_command(python_exe, "ruff") == (str(tool_bin),)
+
+    def test_falls_back_to_module_invocation(self, tmp_path):
+        """Test that "python -m" is used when the tool has no entry point."""
+        python_exe = str(tmp_path / "python.exe")
+
+        assert pf_server._qa_tool_command(python_exe, "black") == (
+            python_exe,
+            "-m",
+            "black",
+        )
+
+    def test_lookup_is_cached(self, tmp_path):
+        """Test that the entry point is only probed once per interpreter and tool."""
+        python_exe = str(tmp_path / "python.exe")
+
+        with patch.object(pf_server.Path, "exists", return_value=True) as mock_exists:
+            pf_server._qa_tool_command(python_exe, "mypy")
+            pf_server._qa_tool_command(python_exe, "mypy")
+
+        assert mock_exists.call_count == 1
+
+
+class TestQAEnvironment:
+    """Test cases for the environment passed to QA tools."""
+
+    def test_environment_is_built_once(self, monkeypatch):
+        """Test that the QA environment is copied from os.environ only once."""
+        monkeypatch.setattr(pf_server, "QA_ENV", None)
+        monkeypatch.delenv("RUFF_LOG_LEVEL", raising=False)
+
+        first = pf_server.get_qa_env()
+        second = pf_server.get_qa_env()
+
+        assert first is second
+        assert first["PYTHONIOENCODING"] == pf_server.os.environ.get(
+            "PYTHONIOENCODING", "utf-8"
+        )
+        assert first["RUFF_LOG_LEVEL"] == "error"
+
+    def test_pipeline_passes_shared_environment(self, tmp_path, mock_subprocess_run):
+        """Test that every QA tool is started with the shared environment."""
+        test_file = tmp_path / "module.py"
+        test_file.write_text("x = 1\n")
+
+        run_python_qa_pipeline(str(test_file), "/mock/python.exe")
+
+        envs = [call.kwargs["env"] for call in mock_subprocess_run.call_args_list]
+        assert envs
+        assert all(env is pf_server.get_qa_env() for env in envs)
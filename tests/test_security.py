@@ -174,7 +174,7 @@ class TestSecurity:
                 return_value=False,
             ),
             patch("sys.argv", test_argv),
-            patch("patch_file_mcp.server.mcp.run", return_value=None) as mock_run,
+            patch("patch_file_mcp.server.create_mcp_server") as mock_create,
             patch("sys.exit") as mock_exit,
         ):
             # Call main function
@@ -184,7 +184,7 @@ class TestSecurity:
             mock_exit.assert_not_called()
 
             # Verify that MCP server run was called
-            mock_run.assert_called_once()
+            mock_create.return_value.run.assert_called_once()
 
             # Verify that no error messages were printed
             captured = capsys.readouterr()
@@ -219,3 +219,37 @@ class TestSecurity:
             with patch("os.geteuid", return_value=0):
                 result = check_administrative_privileges()
                 assert result is True
+
+    def test_patch_file_checks_the_path_it_writes(self, tmp_path):
+        """
+        Test that the allowed-directory check applies to the file actually written.
+
+        On Unix a backslash is an ordinary filename character, while
+        normalize_path treats it as a separator. A path that only looks
+        contained under one of those readings must not reach a file
+        outside the allowed directory.
+        """
+        import pytest
+
+        from patch_file_mcp.server import patch_file
+
+        if os.name == "nt":
+            pytest.skip("Backslashes are path separators on Windows")
+
+        allowed_dir = tmp_path / "allowed"
+        allowed_dir.mkdir()
+        outside_file = tmp_path / "outside.txt"
+        outside_file.write_text("secret\n")
+        sneaky_path = f"{allowed_dir}/a\\b/../../outside.txt"
+
+        patch_content = """<<<<<<< SEARCH
+secret
+=======
+patched
+>>>>>>> REPLACE"""
+
+        with patch("patch_file_mcp.server.allowed_directories", [str(allowed_dir)]):
+            with pytest.raises(FileNotFoundError):
+                patch_file(sneaky_path, patch_content)
+
+        assert outside_file.read_text() == "secret\n"
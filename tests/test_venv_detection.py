@@ -2,11 +2,16 @@
 Tests for virtual environment detection functionality.
 """
 
+import os
 from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
 # Import the functions we want to test
 from patch_file_mcp.server import (
+    VENV_CACHE_TTL,
+    _search_venv_directory,
     find_venv_directory,
     get_current_python_executable,
     is_same_venv,
@@ -56,6 +61,32 @@ class TestVenvDetection:
         assert is_same_venv("/path/to/python.exe", None) is False
         assert is_same_venv(None, None) is False
 
+    def test_is_same_venv_identical_paths_skip_resolve(self):
+        """Test that identical paths are matched without touching the filesystem."""
+        is_same_venv.cache_clear()
+        path = "/project/.venv/Scripts/python.exe"
+
+        with patch.object(Path, "resolve") as mock_resolve:
+            assert is_same_venv(path, path) is True
+
+        mock_resolve.assert_not_called()
+        is_same_venv.cache_clear()
+
+    def test_is_same_venv_resolves_each_pair_once(self):
+        """Test that repeated comparisons of the same pair are memoized."""
+        is_same_venv.cache_clear()
+        path1 = "/project/.venv/Scripts/python.exe"
+        path2 = "/server/.venv/Scripts/python.exe"
+
+        with patch.object(Path, "resolve", autospec=True, side_effect=lambda p: p) as (
+            mock_resolve
+        ):
+            assert is_same_venv(path1, path2) is False
+            assert is_same_venv(path1, path2) is False
+
+        assert mock_resolve.call_count == 2
+        is_same_venv.cache_clear()
+
     def test_find_venv_directory_with_dot_venv(self, tmp_path, mock_venv_path):
         """Test finding .venv directory."""
         # Create a file in the tmp_path directory
@@ -76,6 +107,49 @@ class TestVenvDetection:
             # Should not find the venv because it's the same as current executable
             assert result is None
 
+    def test_find_venv_directory_skips_server_venv_and_walks_up(self, tmp_path):
+        """Test that the server's own venv is skipped and the search continues upward."""
+        outer_exe = tmp_path / ".venv" / "Scripts" / "python.exe"
+        outer_exe.parent.mkdir(parents=True)
+        outer_exe.write_text("# Outer python")
+
+        project_dir = tmp_path / "project"
+        server_exe = project_dir / ".venv" / "Scripts" / "python.exe"
+        server_exe.parent.mkdir(parents=True)
+        server_exe.write_text("# Server python")
+
+        test_file = project_dir / "test.py"
+        test_file.write_text("print('test')")
+
+        with patch("sys.executable", str(server_exe)):
+            result = find_venv_directory(str(test_file))
+
+        assert result == str(outer_exe)
+
+    def test_server_venv_with_symlinked_interpreter_is_skipped_by_path(self, tmp_path):
+        """Test that the server's venv is recognized without following its symlink."""
+        base_python = tmp_path / "base" / "python.exe"
+        base_python.parent.mkdir()
+        base_python.write_text("# Base interpreter")
+        project_dir = tmp_path / "project"
+        scripts_dir = project_dir / ".venv" / "Scripts"
+        scripts_dir.mkdir(parents=True)
+        server_python = scripts_dir / "python.exe"
+        try:
+            server_python.symlink_to(base_python)
+        except (OSError, NotImplementedError):
+            pytest.skip("Symlinks are not supported on this platform")
+        test_file = project_dir / "test.py"
+        test_file.write_text("print('test')")
+
+        with patch(
+            "patch_file_mcp.server.is_same_venv",
+            side_effect=AssertionError("server venv was probed"),
+        ):
+            result = _search_venv_directory(str(test_file), str(server_python))
+
+        assert result is None
+
     def test_find_venv_directory_with_different_venv(self, tmp_path):
         """Test finding a different venv directory."""
         # Create project structure
@@ -205,3 +279,120 @@ class TestVenvDetection:
 
             # Should not find the venv because it's too deep
             assert result is None
+
+
+class TestVenvDetectionCache:
+    """Test cases for caching of venv lookups."""
+
+    @staticmethod
+    def _make_venv(root):
+        scripts_dir = root / ".venv" / "Scripts"
+        scripts_dir.mkdir(parents=True)
+        python_exe = scripts_dir / "python.exe"
+        python_exe.write_text("# Mock python")
+        return python_exe
+
+    def test_repeated_lookup_does_not_walk_again(self, tmp_path):
+        """Test that a second lookup from the same directory uses the cache."""
+        python_exe = self._make_venv(tmp_path)
+        test_file = tmp_path / "test.py"
+        test_file.write_text("print('test')")
+
+        with patch("sys.executable", "/different/python.exe"):
+            assert find_venv_directory(str(test_file)) == str(python_exe)
+            with patch("patch_file_mcp.server._search_venv_directory") as mock_search:
+                assert find_venv_directory(str(tmp_path / "other.py")) == str(
+                    python_exe
+                )
+                mock_search.assert_not_called()
+
+    def test_found_venv_is_cached_for_directories_walked_through(self, tmp_path):
+        """Test that files in intermediate directories reuse a found venv."""
+        python_exe = self._make_venv(tmp_path)
+        deep_dir = tmp_path / "pkg" / "sub"
+        deep_dir.mkdir(parents=True)
+
+        with patch("sys.executable", "/different/python.exe"):
+            assert find_venv_directory(str(deep_dir / "test.py")) == str(python_exe)
+            with patch("patch_file_mcp.server._search_venv_directory") as mock_search:
+                assert find_venv_directory(str(tmp_path / "pkg" / "mod.py")) == str(
+                    python_exe
+                )
+                mock_search.assert_not_called()
+
+    def test_removed_venv_is_looked_up_again(self, tmp_path):
+        """Test that a cached executable that no longer exists is not returned."""
+        python_exe = self._make_venv(tmp_path)
+        test_file = tmp_path / "test.py"
+        test_file.write_text("print('test')")
+
+        with patch("sys.executable", "/different/python.exe"):
+            assert find_venv_directory(str(test_file)) == str(python_exe)
+            python_exe.unlink()
+            assert find_venv_directory(str(test_file)) is None
+
+    def test_missing_venv_is_found_after_ttl(self, tmp_path):
+        """Test that a cached 'no venv' answer expires."""
+        test_file = tmp_path / "test.py"
+        test_file.write_text("print('test')")
+
+        with (
+            patch("sys.executable", "/different/python.exe"),
+            patch("patch_file_mcp.server.time.monotonic", return_value=1000.0),
+        ):
+            assert find_venv_directory(str(test_file)) is None
+            python_exe = self._make_venv(tmp_path)
+            # Still within the TTL: the cached answer stands
+            assert find_venv_directory(str(test_file)) is None
+
+        with (
+            patch("sys.executable", "/different/python.exe"),
+            patch(
+                "patch_file_mcp.server.time.monotonic",
+                return_value=1000.0 + VENV_CACHE_TTL + 1,
+            ),
+        ):
+            assert find_venv_directory(str(test_file)) == str(python_exe)
+
+    def test_nearer_venv_is_found_after_ttl(self, tmp_path):
+        """Test that a cached venv does not hide a nearer one created later."""
+        outer_exe = self._make_venv(tmp_path)
+        project_dir = tmp_path / "project"
+        project_dir.mkdir()
+        test_file = project_dir / "test.py"
+        test_file.write_text("print('test')")
+
+        with (
+            patch("sys.executable", "/different/python.exe"),
+            patch("patch_file_mcp.server.time.monotonic", return_value=1000.0),
+        ):
+            assert find_venv_directory(str(test_file)) == str(outer_exe)
+            inner_exe = self._make_venv(project_dir)
+
+        with (
+            patch("sys.executable", "/different/python.exe"),
+            patch(
+                "patch_file_mcp.server.time.monotonic",
+                return_value=1000.0 + VENV_CACHE_TTL + 1,
+            ),
+        ):
+            assert find_venv_directory(str(test_file)) == str(inner_exe)
+
+    def test_cache_is_bounded(self, tmp_path):
+        """Test that the least recently used directories are evicted."""
+        from patch_file_mcp import server
+
+        with (
+            patch("sys.executable", "/different/python.exe"),
+            patch.object(server, "VENV_CACHE", server.OrderedDict()),
+            patch.object(server, "VENV_CACHE_SIZE", 2),
+        ):
+            for name in ("a", "b", "c"):
+                directory = tmp_path / name
+                directory.mkdir()
+                find_venv_directory(str(directory / "test.py"))
+
+            assert [key[0] for key in server.VENV_CACHE] == [
+                os.path.abspath(tmp_path / "b"),
+                os.path.abspath(tmp_path / "c"),
+            ]